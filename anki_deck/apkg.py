@@ -9,7 +9,6 @@ Based on:
 :copyright: (c) 2015 by Sergey Kozlov
 :license: MIT, see LICENSE for more details.
 """
-import sys
 import os
 import os.path as op
 import shutil
@@ -20,12 +19,10 @@ import sqlite3
 import string
 import random
 import time
+import multiprocessing
 from hashlib import sha1
 from .parser import CardsHandler
-
-
-if sys.version_info[0] > 2:
-    xrange = range
+from .media import process_media
 
 # -- SQL commands --------------------------------------------------------------
 
@@ -128,6 +125,19 @@ def make_card_field(name, order):
     }
 
 
+def make_card_template(name, qfmt, afmt, order):
+    """Create card template struct with given name, formats and order."""
+    return {
+        'name': name,
+        'qfmt': qfmt,
+        'did': None,
+        'bafmt': '',
+        'afmt': afmt,
+        'ord': order,
+        'bqfmt': ''
+    }
+
+
 LATEXPRE = r"""\documentclass[12pt]{article}
 \special{papersize=3in,5in}
 \usepackage[utf8]{inputenc}
@@ -160,6 +170,44 @@ BACK_FMT = r"""{{FrontSide}}
 {{Back}}
 """
 
+REVERSE_FRONT_FMT = r"""{{Back}}
+"""
+
+REVERSE_BACK_FMT = r"""{{FrontSide}}
+<hr id=answer>
+{{Front}}
+<br>
+{{Transcription}}
+<br>
+{{Sound}}
+"""
+
+LISTENING_FRONT_FMT = r"""{{Sound}}
+"""
+
+LISTENING_BACK_FMT = r"""{{FrontSide}}
+<hr id=answer>
+{{Front}}
+<br>
+{{Transcription}}
+<br>
+{{Back}}
+"""
+
+# Available card types: key -> (template name, front format, back format,
+# fields required to be non-empty to generate a card).
+# Each selected card type becomes a template of the deck model and adds
+# one card per note, all cards share the same note data and media.
+CARD_TYPES = {
+    'forward': ('Card 1', FRONT_FMT, BACK_FMT,
+                ['Front', 'Transcription', 'Sound']),
+    'reverse': ('Reverse', REVERSE_FRONT_FMT, REVERSE_BACK_FMT, ['Back']),
+    'listening': ('Listening', LISTENING_FRONT_FMT, LISTENING_BACK_FMT,
+                  ['Sound']),
+}
+
+DEFAULT_CARD_TYPES = ('forward',)
+
 # conf is not very clear, took from existing db.
 CONF = {
    'nextPos': 1,
@@ -185,23 +233,13 @@ MODEL = {
     'vers': [],
     'tags': [],
     'usn': -1,
-    'req': [[0, 'any', [0, 2, 3]]],
+    'req': None,    # Filled by Deck
     'type': 0,
     'css': CSS,
     'sortf': 0,
     'latexPre': LATEXPRE,
     'latexPost': LATEXPOST,
-    'tmpls': [
-        {
-            'name': 'Card 1',
-            'qfmt': FRONT_FMT,
-            'did': None,
-            'bafmt': '',
-            'afmt': BACK_FMT,
-            'ord': 0,
-            'bqfmt': ''
-        }
-    ],
+    'tmpls': None,  # Filled by Deck
     'flds': [
         make_card_field('Front', 0),
         make_card_field('Back', 1),
@@ -230,6 +268,9 @@ DECK = {
 
 # -- Deck configs done ---------------------------------------------------------
 
+# Max number of media files waiting for processing, see Deck.handle().
+MEDIA_BATCH_SIZE = 1000
+
 
 def _guid():
     """Generate random base91 encoded 64bit number."""
@@ -250,6 +291,43 @@ def card_to_flds(card):
     return '\x1f'.join(parts)
 
 
+class MediaWriter(object):
+    """This class writes deck media info file.
+
+    Media info is a JSON object which maps media file number to its name.
+    Entries are written one per line as they are added, so media info is
+    not kept in memory.
+    """
+    def __init__(self, filename):
+        self.out = codecs.open(filename, 'w', 'utf-8')
+        self.out.write('{')
+        self.count = 0
+
+    def add(self, name):
+        """Add media file `name` and return its number."""
+        sep = ',' if self.count else ''
+        entry = '%s: %s' % (json.dumps(str(self.count)), json.dumps(name))
+        self.out.write('%s\n%s' % (sep, entry))
+        self.count += 1
+        return self.count - 1
+
+    def close(self):
+        self.out.write('\n}')
+        self.out.close()
+
+
+def iter_media(filename):
+    """Yield (number, name) pairs from media info file written by
+    :class:`MediaWriter`.
+    """
+    with codecs.open(filename, 'r', 'utf-8') as f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if line not in ('{', '}', ''):
+                for item in json.loads('{%s}' % line).items():
+                    yield item
+
+
 def checksum(text):
     """Create checksum.
 
@@ -261,13 +339,31 @@ def checksum(text):
 
 class Deck(CardsHandler):
     """This class creates Anki `apkg` file."""
-    def __init__(self, filename, sound_path, name):
+    def __init__(self, filename, sound_path, name, card_types=None,
+                 media_cache=None):
         self.sound_path = sound_path
         self.outpath = tempfile.mkdtemp(prefix='anki_deck_', )
         self.filename = filename
 
         self.cursor = None
-        self.media = {}  # to map input sound file names to result file names.
+        self.media = None   # MediaWriter, maps media numbers to file names.
+
+        # If set then sound files are processed with the cache instead of
+        # plain copy, see anki_deck.media.MediaCache.
+        self.media_cache = media_cache
+        self.media_processes = None     # Number of CPUs.
+        self.media_pending = []     # (src, dst) files to process.
+        self.media_pool = None
+
+        # Card types (see CARD_TYPES) to generate for each note,
+        # repeated types are skipped.
+        self.card_types = []
+        for key in card_types or DEFAULT_CARD_TYPES:
+            if key not in CARD_TYPES:
+                raise ValueError('Unknown card type: %s' % key)
+            if key not in self.card_types:
+                self.card_types.append(key)
+        self.tmpls, self.req = self._make_templates()
 
         # Initial deck data.
         self.deck_name = name
@@ -279,6 +375,7 @@ class Deck(CardsHandler):
         self.deck_id_str = str(self.deck_id)
         self.note_id_start = self.deck_id + 1
         self.note_id = self.note_id_start
+        self.merged = False     # True if there are notes added by merge().
 
     def _run_sql(self, sql_list):
         for sql in sql_list:
@@ -300,6 +397,8 @@ class Deck(CardsHandler):
         MODEL['name'] = 'AnkiDeck-%s-%d' % (self.deck_name, self.epoch)
         MODEL['did'] = self.deck_id
         MODEL['mod'] = self.epoch
+        MODEL['tmpls'] = self.tmpls
+        MODEL['req'] = self.req
         models = {self.model_id_str: MODEL}
 
         DECK['id'] = self.deck_id
@@ -318,27 +417,111 @@ class Deck(CardsHandler):
         c = self.conn.cursor()
         c.execute("INSERT INTO col VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", vals)
 
+    # Build model templates and requirements for the selected card types.
+    def _make_templates(self):
+        fields = dict((x['name'], x['ord']) for x in MODEL['flds'])
+        tmpls = []
+        req = []
+        for order, key in enumerate(self.card_types):
+            name, qfmt, afmt, required = CARD_TYPES[key]
+            tmpls.append(make_card_template(name, qfmt, afmt, order))
+            req.append([order, 'any', [fields[x] for x in required]])
+        return tmpls, req
+
+    # Yield cards table rows for all notes stored in the DB.
+    #
+    # Each note gets a card per selected card type, unless all fields
+    # required by the card type are empty (e.g. listening card for a word
+    # without sound). Cards of the same note share the same due position.
+    def _iter_cards(self):
+        card_id = self.note_id
+        reqs = [fields for _, _, fields in self.req]
+        c = self.conn.cursor()
+        c.execute("SELECT id, flds FROM notes ORDER BY id")
+        for i, (nid, flds) in enumerate(c):
+            flds = flds.split('\x1f')
+            for order, fields in enumerate(reqs):
+                if not any(flds[x] for x in fields):
+                    continue
+                yield [card_id, nid, self.deck_id, order, self.epoch, -1,
+                       0, 0, i + 1, 0, 0, 0, 0, 0, 0, 0, 0, '']
+                card_id += 1
+
     def start(self):
         if op.exists(self.filename):
             os.unlink(self.filename)
 
         self._prepare_db()
+        self.media = MediaWriter(op.join(self.outpath, 'media'))
+
+    # Process pending media files.
+    def _process_media(self):
+        if self.media_pool is None and self.media_processes != 1:
+            self.media_pool = multiprocessing.Pool(self.media_processes)
+        process_media(self.media_cache, self.media_pending, self.media_pool)
+        self.media_pending = []
+
+    # Process rest of media files and close media info (about sound files
+    # which we added in the handle()).
+    def _save_media(self):
+        if self.media_pending:
+            self._process_media()
+        if self.media_pool is not None:
+            self.media_pool.close()
+            self.media_pool.join()
+            self.media_pool = None
+        self.media.close()
+
+    def merge(self, path):
+        """Merge notes and media of the partial deck built by
+        :class:`DeckShard` in the `path` dir.
+
+        Notes are collected in a temp table and added to the deck in the
+        dict order of all merged shards by :meth:`finish`, so IDs and
+        cards order are the same as for a deck built in one pass.
+        Media files are renumbered.
+        Must be called between :meth:`start` and :meth:`finish`.
+        """
+        if not self.merged:
+            self.cursor.execute(
+                "CREATE TEMP TABLE merged_notes AS SELECT * FROM notes"
+                " WHERE 0")
+            self.merged = True
+
+        self.cursor.execute("ATTACH DATABASE ? AS shard",
+                            (op.join(path, 'collection.anki2'),))
+        self.cursor.execute(
+            "INSERT INTO merged_notes SELECT * FROM shard.notes")
+        self.conn.commit()
+        self.cursor.execute("DETACH DATABASE shard")
 
-    def finish(self):
-        # Save media info (about sound files which we copied in the handle().
-        with codecs.open(op.join(self.outpath, 'media'), 'w', 'utf-8') as out:
-            out.write(json.dumps(self.media))
+        for index, sound in iter_media(op.join(path, 'media')):
+            new_index = self.media.add(sound)
+            shutil.move(op.join(path, index),
+                        op.join(self.outpath, str(new_index)))
+
+    # Add merged notes in the dict order, shard note ID is the article
+    # position in the dict, see DeckShard.handle().
+    def _add_merged_notes(self):
+        self.cursor.execute(
+            "INSERT INTO notes SELECT"
+            " ? + ROW_NUMBER() OVER (ORDER BY id) - 1, guid, ?, mod, usn,"
+            " tags, flds, sfld, csum, flags, data"
+            " FROM temp.merged_notes ORDER BY id",
+            (self.note_id, self.model_id))
+        self.note_id += self.cursor.rowcount
+        self.cursor.execute("DROP TABLE temp.merged_notes")
+        self.merged = False
 
-        # Add cards for each word.
-        gen = []
-        for i in xrange(self.note_id - self.note_id_start):
-            gen.append([self.note_id + i, self.note_id_start + i, self.deck_id,
-                        0, self.epoch, -1, 0, 0, i + 1, 0, 0, 0, 0, 0, 0,
-                        0, 0, ''])
+    def finish(self):
+        self._save_media()
+        if self.merged:
+            self._add_merged_notes()
 
+        # Add cards for each word, one per card type.
         self.cursor.executemany(
             "INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-            gen)
+            self._iter_cards())
 
         # Create required indexes.
         self._run_sql(INDEXES)
@@ -351,7 +534,10 @@ class Deck(CardsHandler):
             for name in os.listdir(self.outpath):
                 deck.write(op.join(self.outpath, name), name)
 
-        # Try to cleanup - remove out temp dir where all stuff is generated.
+        self.cleanup()
+
+    def cleanup(self):
+        """Remove temp dir where all stuff is generated."""
         # It's ok if it fails so we skip all exceptions.
         try:
             shutil.rmtree(self.outpath)
@@ -363,9 +549,14 @@ class Deck(CardsHandler):
             src_sound = op.join(self.sound_path, card.sound)
             if op.exists(src_sound):
                 # Map sound file to a number and copy it to the temp dir.
-                index = len(self.media)
-                self.media[index] = card.sound
-                shutil.copy(src_sound, op.join(self.outpath, str(index)))
+                index = self.media.add(card.sound)
+                dst_sound = op.join(self.outpath, str(index))
+                if self.media_cache:
+                    self.media_pending.append((src_sound, dst_sound))
+                    if len(self.media_pending) >= MEDIA_BATCH_SIZE:
+                        self._process_media()
+                else:
+                    shutil.copy(src_sound, dst_sound)
 
         # Put word with all required into to the DB record.
         vals = (
@@ -390,3 +581,32 @@ class Deck(CardsHandler):
         # and later for IDs for records in cards table, see finish().
         self.note_id += 1
 
+
+class DeckShard(Deck):
+    """This class creates partial deck - collection DB with notes and media
+    files in the :attr:`outpath` dir.
+
+    Shards are built independently (e.g. in worker processes) and then
+    combined with :meth:`Deck.merge`. Cards are not created for shards,
+    the final deck creates them for all merged notes.
+    """
+    def __init__(self, sound_path, name, media_cache=None):
+        super(DeckShard, self).__init__(None, sound_path, name,
+                                        media_cache=media_cache)
+        # Shards are built in worker processes already.
+        self.media_processes = 1
+
+    def start(self):
+        self._prepare_db()
+        self.media = MediaWriter(op.join(self.outpath, 'media'))
+
+    def finish(self):
+        self._save_media()
+        self.conn.commit()
+        self.conn.close()
+
+    def handle(self, card):
+        # Note ID is the article position in the dict, so merged notes may
+        # be sorted in the dict order.
+        self.note_id = card.position
+        super(DeckShard, self).handle(card)
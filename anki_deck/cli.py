@@ -6,12 +6,16 @@ This module implements command line interface for the anki_deck.
 """
 import sys
 import os.path as op
+import json
 import logging
 import click
 from anki_deck import __version__
-from anki_deck.apkg import Deck
+from anki_deck.apkg import Deck, CARD_TYPES, DEFAULT_CARD_TYPES
 from anki_deck.flashcards import FlashcardsWriter
+from anki_deck.media import MediaCache, MediaError, PROCESSORS
 from anki_deck.parser import get_cards
+from anki_deck.shard import get_deck_sharded
+from anki_deck.verify import ApkgError, inspect_deck, diff_decks
 
 
 @click.group(context_settings=dict(help_option_names=['-h', '--help']))
@@ -22,8 +26,10 @@ from anki_deck.parser import get_cards
 @click.option('--audio', '-a', help='Directory with audio files in ogg format.')
 @click.option('--words', '-w', help='Input words file.', default='words.txt',
               show_default=True)
+@click.option('--max-article-size', type=click.IntRange(min=1),
+              help='Truncate translations longer than this number of chars.')
 @click.pass_context
-def run(ctx, input_dir, dict, audio, words):
+def run(ctx, input_dir, dict, audio, words, max_article_size):
     """Tool to generate cards file which may be imported to Anki."""
 
     logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
@@ -32,6 +38,7 @@ def run(ctx, input_dir, dict, audio, words):
     ctx.meta['dict'] = dict
     ctx.meta['audio'] = audio
     ctx.meta['words'] = words
+    ctx.meta['max_article_size'] = max_article_size
 
     if input_dir:
         if not dict:
@@ -47,14 +54,26 @@ def run(ctx, input_dir, dict, audio, words):
 def txt(ctx, out):
     """Generate text flashcards file."""
     handler = FlashcardsWriter(out)
-    get_cards(ctx.meta['words'], ctx.meta['dict'], ctx.meta['audio'], handler)
+    get_cards(ctx.meta['words'], ctx.meta['dict'], ctx.meta['audio'], handler,
+              ctx.meta['max_article_size'])
 
 
 @run.command()
 @click.option('--deck-name', '-n', help="Deck name.")
+@click.option('--cards', '-c', multiple=True, default=DEFAULT_CARD_TYPES,
+              type=click.Choice(sorted(CARD_TYPES)), show_default=True,
+              help="Card type to generate for each word, may be repeated.")
+@click.option('--jobs', '-j', type=click.IntRange(min=0), default=1,
+              show_default=True,
+              help="Number of worker processes, 0 means number of CPUs.")
+@click.option('--media', '-m', type=click.Choice(sorted(PROCESSORS)),
+              default='copy', show_default=True,
+              help="Audio processing, results are cached between builds.")
+@click.option('--media-cache', type=click.Path(file_okay=False),
+              help="Processed audio cache dir.")
 @click.argument('out')
 @click.pass_context
-def deck(ctx, deck_name, out):
+def deck(ctx, deck_name, cards, jobs, media, media_cache, out):
     """Generate apkg deck."""
     name, ext = op.splitext(out)
 
@@ -67,8 +86,58 @@ def deck(ctx, deck_name, out):
     if deck_name is None:
         deck_name = name
 
-    handler = Deck(out, ctx.meta['audio'], deck_name)
-    get_cards(ctx.meta['words'], ctx.meta['dict'], ctx.meta['audio'], handler)
+    cache = None
+    if media_cache and media == 'copy':
+        logging.error('--media-cache requires --media other than copy')
+        sys.exit(1)
+    elif media != 'copy':
+        try:
+            cache = MediaCache(PROCESSORS[media](), media_cache)
+        except MediaError as e:
+            logging.error(e)
+            sys.exit(1)
+
+    handler = Deck(out, ctx.meta['audio'], deck_name, cards, cache)
+    if jobs == 1:
+        get_cards(ctx.meta['words'], ctx.meta['dict'], ctx.meta['audio'],
+                  handler, ctx.meta['max_article_size'])
+    else:
+        get_deck_sharded(ctx.meta['words'], ctx.meta['dict'],
+                         ctx.meta['audio'], handler, jobs,
+                         ctx.meta['max_article_size'])
+
+
+@run.command()
+@click.argument('deck', type=click.Path(exists=True, dir_okay=False))
+def inspect(deck):
+    """Print apkg deck summary in JSON format."""
+    try:
+        result = inspect_deck(deck)
+    except ApkgError as e:
+        logging.error(e)
+        sys.exit(2)
+    click.echo(json.dumps(result, indent=2, sort_keys=True))
+
+
+@run.command()
+@click.option('--limit', '-l', type=click.IntRange(min=0), default=20,
+              show_default=True,
+              help="Max number of sample entries for each difference.")
+@click.argument('deck_a', type=click.Path(exists=True, dir_okay=False))
+@click.argument('deck_b', type=click.Path(exists=True, dir_okay=False))
+def diff(limit, deck_a, deck_b):
+    """Compare content of two apkg decks and print summary in JSON format.
+
+    Exits with status 1 if decks are different and 2 on errors.
+    """
+    try:
+        result = diff_decks(deck_a, deck_b, limit)
+    except ApkgError as e:
+        logging.error(e)
+        sys.exit(2)
+    click.echo(json.dumps(result, indent=2, sort_keys=True))
+    if not result['equal']:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+"""
+This module implements media files processing for the Anki decks.
+
+Processors convert source media files (e.g. normalize or downsample
+audio) and results are stored in a cache keyed by source content hash,
+so each file is processed only once across all builds.
+
+:copyright: (c) 2015 by Sergey Kozlov
+:license: MIT, see LICENSE for more details.
+"""
+import os
+import os.path as op
+import shutil
+import subprocess
+import tempfile
+import logging
+from hashlib import sha1
+
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = op.join(op.expanduser('~'), '.cache', 'anki_deck', 'media')
+
+
+class MediaError(Exception):
+    pass
+
+
+class MediaProcessor(object):
+    """Base class for the media processors, copies files as is.
+
+    :attr:`key` identifies processing result and is a part of the cache key,
+    so it must be changed if processing options are changed.
+    """
+    key = 'copy'
+
+    def process(self, src, dst):
+        """Process `src` file and save result to `dst`."""
+        shutil.copy(src, dst)
+
+
+class CommandProcessor(MediaProcessor):
+    """This class processes media files with external command.
+
+    Args:
+        args: Command line, ``{src}`` and ``{dst}`` are replaced with
+            input and output filenames.
+    """
+    def __init__(self, args):
+        if not which(args[0]):
+            raise MediaError('Command not found: %s' % args[0])
+        self.args = args
+        self.key = ' '.join(args)
+
+    def process(self, src, dst):
+        args = [x.format(src=src, dst=dst) for x in self.args]
+        try:
+            subprocess.check_call(args)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise MediaError('Failed to process %s: %s' % (src, e))
+
+
+class FfmpegProcessor(CommandProcessor):
+    """This class converts audio to mono normalized ogg vorbis with `ffmpeg`.
+
+    Args:
+        rate: Output sample rate.
+        quality: Vorbis quality, from -1 to 10.
+    """
+    def __init__(self, rate=22050, quality=2):
+        super(FfmpegProcessor, self).__init__([
+            'ffmpeg', '-nostdin', '-y', '-loglevel', 'error', '-i', '{src}',
+            '-vn', '-af', 'loudnorm', '-ac', '1', '-ar', str(rate),
+            '-c:a', 'libvorbis', '-q:a', str(quality), '-f', 'ogg', '{dst}'
+        ])
+
+
+PROCESSORS = {
+    'copy': MediaProcessor,
+    'ffmpeg': FfmpegProcessor,
+}
+
+
+def stream_hash(f):
+    """Return sha1 hex digest of the binary file object content."""
+    h = sha1()
+    for chunk in iter(lambda: f.read(65536), b''):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def file_hash(filename):
+    """Return sha1 hex digest of the file content."""
+    with open(filename, 'rb') as f:
+        return stream_hash(f)
+
+
+class MediaCache(object):
+    """This class processes media files with `processor` and caches results.
+
+    Cached file name is a hash of the source file content and processor
+    key, so the same file is processed only once for the given processor.
+
+    Args:
+        processor: :class:`MediaProcessor` instance.
+        path: Cache dir.
+    """
+    def __init__(self, processor, path=None):
+        self.processor = processor
+        self.path = path or DEFAULT_CACHE_DIR
+
+    def _cache_name(self, src):
+        h = sha1(self.processor.key.encode('utf-8'))
+        h.update(file_hash(src).encode('ascii'))
+        return op.join(self.path, h.hexdigest())
+
+    def get(self, src, dst):
+        """Save processed `src` file to `dst` using cached result if any."""
+        cached = self._cache_name(src)
+
+        if not op.exists(cached):
+            if not op.isdir(self.path):
+                try:
+                    os.makedirs(self.path)
+                except OSError:
+                    pass    # May be created by another worker.
+
+            # Process to a temp file and then move it to the cache to make
+            # sure concurrent builds never see partially written files.
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            os.close(fd)
+            try:
+                self.processor.process(src, tmp)
+                os.rename(tmp, cached)
+            except OSError:
+                if not op.exists(cached):
+                    raise
+            finally:
+                if op.exists(tmp):
+                    os.unlink(tmp)
+
+        shutil.copy(cached, dst)
+
+
+def _process_one(args):
+    cache, src, dst = args
+    try:
+        cache.get(src, dst)
+    except MediaError as e:
+        # Don't fail the whole deck because of a single file.
+        logger.warning('Using original file. %s', e)
+        shutil.copy(src, dst)
+
+
+def process_media(cache, files, pool=None):
+    """Process media `files` with `cache`.
+
+    Args:
+        cache: :class:`MediaCache` instance.
+        files: List of (src, dst) filenames.
+        pool: ``multiprocessing.Pool`` to process files in parallel.
+            If None then files are processed in the current process.
+    """
+    tasks = [(cache, src, dst) for src, dst in files]
+    if pool is None or len(tasks) < 2:
+        for task in tasks:
+            _process_one(task)
+    else:
+        pool.map(_process_one, tasks)
@@ -6,7 +6,7 @@ This module XDXF parser and tools.
 """
 import sys
 import os.path as op
-import codecs
+import io
 import logging
 from bs4 import BeautifulSoup
 
@@ -25,6 +25,7 @@ class Card(object):
         self.info = []
         self.transcription = None
         self.sound = None
+        self.position = None    # Article number in the dict file.
 
 
 class CardsHandler(object):
@@ -60,10 +61,13 @@ def _set_transcription(card):
 
     If transcription is placed at very beginning then remove it.
     """
+    card.transcription = ''
     for i, x in enumerate(card.info):
         first = x.find('[')
         if first != -1:
-            last = x.index(']')
+            last = x.find(']', first)
+            if last == -1:
+                continue
             card.transcription = x[first:last + 1]
             if not i:
                 card.info[i] = x[last + 1:]
@@ -116,12 +120,16 @@ def _xml_cleanup(card):
     return text_type(soup).replace('\n', ' ')
 
 
-def parse_cards(word_list, dict_file):
+def parse_cards(word_list, dict_file, max_article_size=None):
     """Yields a Card for each word in the `word_list`.
 
     Args:
         word_list: List of words for which return cards.
         dict_file: Filename of the dict in the xdxf format.
+        max_article_size: Max number of characters to read from the word
+            translation info. Whole lines are dropped after the limit is
+            reached, only the first line is cut at the limit if it's too
+            long. Unlimited if None.
 
     Returns:
         Card object.
@@ -129,24 +137,42 @@ def parse_cards(word_list, dict_file):
     # Read dict file liny by line and search lines:
     #  * '<ar><k>...' - starts a word translation info
     #  * '...</ar>' - ends translation info
-    with codecs.open(dict_file, 'r', 'utf-8') as d:
+    with io.open(dict_file, 'r', encoding='utf-8', newline='') as d:
         card = None
+        size = 0
+        truncated = False
+        position = -1
 
         for line in d:
             # Translation info started.
             # We extract word from the line '<ar><k>[word]</k>'
             # TODO: is line format always '<ar><k>[word]</k>'?
             if not card and line.startswith('<ar><k>'):
+                position += 1
                 text = line[7:-5].lower().replace('&apos;', "'")
                 if text in word_list:
                     card = Card()
                     card.word = text
+                    card.position = position
                     card.sound = card.word + '.ogg'
                     word_list.remove(text)
+                    size = 0
+                    truncated = False
 
             # If word is started then we add lines to the info list.
             elif card:
-                card.info.append(line)
+                if max_article_size is None:
+                    card.info.append(line)
+                elif not truncated:
+                    if size + len(line) <= max_article_size:
+                        card.info.append(line)
+                        size += len(line)
+                    else:
+                        if not card.info:
+                            card.info.append(line[:max_article_size])
+                        truncated = True
+                        logger.warning('Too big translation is truncated: %s',
+                                       card.word)
 
                 # If this line ends word translation then save all data
                 # to the flashcard.
@@ -162,7 +188,54 @@ def parse_cards(word_list, dict_file):
                         break
 
 
-def get_cards(words_file, dict_file, sound_path, card_handler):
+def read_words(words_file):
+    """Read words list from the `words_file`.
+
+    Args:
+        words_file: Words filename, one word per line.
+
+    Returns:
+        Set of lowercase words.
+    """
+    with open(words_file, 'r') as words:
+        word_list = set(x.strip().lower() for x in words if x.strip())
+
+    if not word_list:
+        raise ParseError('Empty words file')
+    return word_list
+
+
+def handle_cards(word_list, dict_file, sound_path, card_handler,
+                 max_article_size=None):
+    """Run `card_handler` on cards for `word_list` extracted from `dict_file`.
+
+    Found words are removed from the `word_list`, so after the call it
+    contains only words without translations.
+
+    Args:
+        word_list: Set of words for which handle cards.
+        dict_file: Filename of the dict in the xdxf format.
+        sound_path: Path to dir with ogg audio files with names `<word>.ogg`.
+        card_handler: :class:`CardsHandler` instance.
+        max_article_size: Max translation size, see :func:`parse_cards`.
+    """
+    need_audio = op.exists(sound_path) if sound_path else False
+    card_handler.start()
+
+    for card in parse_cards(word_list, dict_file, max_article_size):
+        if need_audio:
+            path = op.join(sound_path, card.sound)
+            if not op.exists(path):
+                card.sound = None
+                logger.warning('Missing sound %s', path)
+        else:
+            card.sound = None
+        card_handler.handle(card)
+    card_handler.finish()
+
+
+def get_cards(words_file, dict_file, sound_path, card_handler,
+              max_article_size=None):
     """Run `card_handler` on cards for `words_file` extracted from `dict_file`.
 
     Args:
@@ -170,27 +243,12 @@ def get_cards(words_file, dict_file, sound_path, card_handler):
         dict_file: Filename of the dict in the xdxf format.
         sound_path: Path to dir with ogg audio files with names `<word>.ogg`.
         card_handler: :class:`CardsHandler` instance.
+        max_article_size: Max translation size, see :func:`parse_cards`.
     """
     try:
-        with open(words_file, 'r') as words:
-            word_list = set(x.strip().lower() for x in words if x.strip())
-
-        if not word_list:
-            raise ParseError('Empty words file')
-
-        need_audio = op.exists(sound_path) if sound_path else False
-        card_handler.start()
-
-        for card in parse_cards(word_list, dict_file):
-            if need_audio:
-                path = op.join(sound_path, card.sound)
-                if not op.exists(path):
-                    card.sound = None
-                    logger.warning('Missing sound %s', path)
-            else:
-                card.sound = None
-            card_handler.handle(card)
-        card_handler.finish()
+        word_list = read_words(words_file)
+        handle_cards(word_list, dict_file, sound_path, card_handler,
+                     max_article_size)
 
         if word_list:
             logger.warning('Missing translations: %s', ', '.join(word_list))
@@ -0,0 +1,99 @@
+"""
+This module implements parallel Anki deck generation.
+
+Words list is split into shards, each shard is processed in a separate
+worker process by :class:`~anki_deck.apkg.DeckShard` and then all shards
+are merged into a single deck.
+
+:copyright: (c) 2015 by Sergey Kozlov
+:license: MIT, see LICENSE for more details.
+"""
+import sys
+import shutil
+import logging
+import multiprocessing
+from .apkg import DeckShard
+from .parser import read_words, handle_cards
+
+logger = logging.getLogger(__name__)
+
+
+def split_words(word_list, count):
+    """Split `word_list` into `count` lists of nearly the same size."""
+    words = sorted(word_list)
+    return [set(words[i::count]) for i in range(count)]
+
+
+def _build_shard(args):
+    """Build deck shard and return its dir and words without translations."""
+    word_list, dict_file, sound_path, name, media_cache, max_size = args
+    handler = DeckShard(sound_path, name, media_cache)
+    try:
+        handle_cards(word_list, dict_file, sound_path, handler, max_size)
+    except Exception:
+        shutil.rmtree(handler.outpath, ignore_errors=True)
+        raise
+    return handler.outpath, word_list
+
+
+def get_deck_sharded(words_file, dict_file, sound_path, deck, jobs=None,
+                     max_article_size=None):
+    """Build `deck` for `words_file` using `jobs` worker processes.
+
+    Args:
+        words_file: Words filename.
+        dict_file: Filename of the dict in the xdxf format.
+        sound_path: Path to dir with ogg audio files with names `<word>.ogg`.
+        deck: :class:`~anki_deck.apkg.Deck` instance to merge shards into.
+        jobs: Number of worker processes, number of CPUs by default.
+        max_article_size: Max translation size, see
+            :func:`~anki_deck.parser.parse_cards`.
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+
+    try:
+        word_list = read_words(words_file)
+        shards = split_words(word_list, min(jobs, len(word_list)))
+        tasks = [(x, dict_file, sound_path, deck.deck_name, deck.media_cache,
+                  max_article_size) for x in shards]
+
+        # Wait for all shards even if some of them fail, so dirs of the
+        # finished ones may be removed.
+        results = []
+        error = None
+        pool = multiprocessing.Pool(len(tasks))
+        try:
+            pending = [pool.apply_async(_build_shard, (x,)) for x in tasks]
+            for x in pending:
+                try:
+                    results.append(x.get())
+                except Exception as e:
+                    error = error or e
+        finally:
+            pool.close()
+            pool.join()
+
+        try:
+            if error is not None:
+                raise error
+
+            deck.start()
+            missing = set()
+            for path, words in results:
+                deck.merge(path)
+                missing.update(words)
+                shutil.rmtree(path, ignore_errors=True)
+            deck.finish()
+        except Exception:
+            deck.cleanup()
+            raise
+        finally:
+            # It's ok if cleanup fails so we skip all exceptions.
+            for path, _ in results:
+                shutil.rmtree(path, ignore_errors=True)
+
+        if missing:
+            logger.warning('Missing translations: %s', ', '.join(missing))
+    except IOError as e:
+        logger.error(e)
+        sys.exit(1)
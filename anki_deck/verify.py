@@ -0,0 +1,276 @@
+"""
+This module implements inspection and comparison of the Anki `apkg` files.
+
+Decks are compared by content: notes by sort field, checksum and fields,
+cards by note sort field, template number and study order, media by
+content hash, models and decks configs without IDs and timestamps. So two
+builds of the same deck are equal even though they have different GUIDs
+and IDs.
+
+:copyright: (c) 2015 by Sergey Kozlov
+:license: MIT, see LICENSE for more details.
+"""
+import shutil
+import json
+import sqlite3
+import tempfile
+import zipfile
+from .media import stream_hash
+
+# Config keys which are different for each build.
+VOLATILE_MODEL_KEYS = ('id', 'name', 'did', 'mod', 'usn')
+VOLATILE_TEMPLATE_KEYS = ('did',)
+VOLATILE_DECK_KEYS = ('id', 'mod', 'usn')
+
+
+class ApkgError(Exception):
+    pass
+
+
+class ApkgFile(object):
+    """This class provides read access to the `apkg` file.
+
+    Only collection DB is extracted to a temp dir, media files are read
+    directly from the archive.
+
+    Raises:
+        ApkgError: If file is not a valid `apkg` file.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            self.zip = zipfile.ZipFile(filename)
+        except zipfile.BadZipfile as e:
+            raise ApkgError('%s: %s' % (filename, e))
+
+        for name in ('collection.anki2', 'media'):
+            try:
+                self.zip.getinfo(name)
+            except KeyError:
+                self.zip.close()
+                raise ApkgError('%s: missing %s' % (filename, name))
+
+        self.tmpdir = tempfile.mkdtemp(prefix='anki_deck_')
+        try:
+            self.db = self.zip.extract('collection.anki2', self.tmpdir)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.zip.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def media(self):
+        """Return media info: file number -> file name."""
+        return json.loads(self.zip.read('media').decode('utf-8'))
+
+    def media_hashes(self):
+        """Return dict: media file name -> sha1 hex digest of the content."""
+        hashes = {}
+        for index, name in self.media().items():
+            try:
+                with self.zip.open(index) as f:
+                    hashes[name] = stream_hash(f)
+            except KeyError:
+                raise ApkgError('%s: missing media file %s (%s)'
+                                % (self.filename, index, name))
+        return hashes
+
+
+def _read_config(conn, schema='main'):
+    """Return (models, decks) configs from the collection DB `schema`."""
+    models, decks = conn.execute(
+        "SELECT models, decks FROM %s.col" % schema).fetchone()
+    return json.loads(models), json.loads(decks)
+
+
+# Create temp table `name` with cards study order in the DB `schema`:
+# position, note sort field and template number.
+def _make_study_order(conn, name, schema):
+    conn.execute("CREATE TEMP TABLE %s"
+                 " (pos INTEGER PRIMARY KEY, sfld, ord)" % name)
+    conn.execute(
+        "INSERT INTO temp.%(name)s SELECT"
+        " ROW_NUMBER() OVER (ORDER BY c.due, c.ord, c.id), n.sfld, c.ord"
+        " FROM %(db)s.cards c JOIN %(db)s.notes n ON n.id = c.nid"
+        % {'name': name, 'db': schema})
+
+
+def _strip(obj, keys):
+    return dict((k, v) for k, v in obj.items() if k not in keys)
+
+
+def normalize_models(models):
+    """Return list of models configs without build specific values."""
+    result = []
+    for model in models.values():
+        model = _strip(model, VOLATILE_MODEL_KEYS)
+        model['tmpls'] = [_strip(x, VOLATILE_TEMPLATE_KEYS)
+                          for x in model.get('tmpls', [])]
+        result.append(model)
+    return sorted(result, key=lambda x: json.dumps(x, sort_keys=True))
+
+
+def normalize_decks(decks):
+    """Return list of decks configs without build specific values."""
+    result = [_strip(x, VOLATILE_DECK_KEYS) for x in decks.values()]
+    return sorted(result, key=lambda x: json.dumps(x, sort_keys=True))
+
+
+def inspect_deck(filename):
+    """Return summary info for the deck `filename`.
+
+    Raises:
+        ApkgError: If file is not a valid `apkg` file.
+    """
+    with ApkgFile(filename) as apkg:
+        conn = sqlite3.connect(apkg.db)
+        try:
+            models, decks = _read_config(conn)
+            notes = conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+            cards = conn.execute(
+                "SELECT ord, COUNT(*) FROM cards GROUP BY ord").fetchall()
+        except sqlite3.DatabaseError as e:
+            raise ApkgError('%s: %s' % (filename, e))
+        finally:
+            conn.close()
+
+        media = apkg.media()
+        media_size = 0
+        for index, name in media.items():
+            try:
+                media_size += apkg.zip.getinfo(index).file_size
+            except KeyError:
+                raise ApkgError('%s: missing media file %s (%s)'
+                                % (filename, index, name))
+
+    return {
+        'notes': notes,
+        'cards': sum(x[1] for x in cards),
+        'cards_by_template': dict((str(k), v) for k, v in cards),
+        'media': len(media),
+        'media_size': media_size,
+        'models': [{'name': x['name'],
+                    'fields': [f['name'] for f in x['flds']],
+                    'templates': [t['name'] for t in x['tmpls']]}
+                   for x in models.values()],
+        'decks': [x['name'] for x in decks.values()],
+    }
+
+
+def _query_diff(conn, sql, limit):
+    """Return number of rows returned by `sql` and first `limit` of them."""
+    count = conn.execute("SELECT COUNT(*) FROM (%s)" % sql).fetchone()[0]
+    rows = conn.execute("%s LIMIT %d" % (sql, limit)).fetchall()
+    return count, [x[0] if len(x) == 1 else list(x) for x in rows]
+
+
+def _diff_sql(conn, queries, limit):
+    """Run `queries` (key -> sql) and return counts and samples."""
+    result = {}
+    for key, sql in queries:
+        result[key], result[key + '_samples'] = _query_diff(conn, sql, limit)
+    return result
+
+
+def _diff_keys(a, b, limit):
+    """Compare two dicts by keys and values."""
+    only_a = sorted(set(a) - set(b))
+    only_b = sorted(set(b) - set(a))
+    changed = sorted(k for k in set(a) & set(b) if a[k] != b[k])
+    return {
+        'only_a': len(only_a),
+        'only_a_samples': only_a[:limit],
+        'only_b': len(only_b),
+        'only_b_samples': only_b[:limit],
+        'changed': len(changed),
+        'changed_samples': changed[:limit],
+    }
+
+
+def diff_decks(filename_a, filename_b, limit=20):
+    """Compare content of two decks.
+
+    Args:
+        filename_a: First deck filename.
+        filename_b: Second deck filename.
+        limit: Max number of sample entries in each result list.
+
+    Returns:
+        Dict with differences summary, ``equal`` key is True if decks
+        have the same content.
+
+    Raises:
+        ApkgError: If any file is not a valid `apkg` file.
+    """
+    with ApkgFile(filename_a) as a, ApkgFile(filename_b) as b:
+        conn = sqlite3.connect(a.db)
+        try:
+            conn.execute("ATTACH DATABASE ? AS b", (b.db,))
+
+            # Notes are identified by sort field.
+            notes_a = "SELECT sfld, csum, flds FROM main.notes"
+            notes_b = "SELECT sfld, csum, flds FROM b.notes"
+            notes = _diff_sql(conn, [
+                ('only_a', "SELECT sfld FROM main.notes EXCEPT"
+                           " SELECT sfld FROM b.notes"),
+                ('only_b', "SELECT sfld FROM b.notes EXCEPT"
+                           " SELECT sfld FROM main.notes"),
+                ('changed', "SELECT sfld FROM (%s EXCEPT %s)"
+                            " WHERE sfld IN (SELECT sfld FROM b.notes)"
+                            " UNION"
+                            " SELECT sfld FROM (%s EXCEPT %s)"
+                            " WHERE sfld IN (SELECT sfld FROM main.notes)"
+                            % (notes_a, notes_b, notes_b, notes_a)),
+            ], limit)
+
+            cards_a = ("SELECT n.sfld, c.ord FROM main.cards c"
+                       " JOIN main.notes n ON n.id = c.nid")
+            cards_b = ("SELECT n.sfld, c.ord FROM b.cards c"
+                       " JOIN b.notes n ON n.id = c.nid")
+            cards = _diff_sql(conn, [
+                ('only_a', "%s EXCEPT %s" % (cards_a, cards_b)),
+                ('only_b', "%s EXCEPT %s" % (cards_b, cards_a)),
+            ], limit)
+
+            # Cards at the same study position must be for the same word
+            # and template.
+            _make_study_order(conn, 'order_a', 'main')
+            _make_study_order(conn, 'order_b', 'b')
+            cards.update(_diff_sql(conn, [
+                ('order', "SELECT a.pos, a.sfld, a.ord, b.sfld, b.ord"
+                          " FROM temp.order_a a JOIN temp.order_b b"
+                          " ON a.pos = b.pos"
+                          " WHERE a.sfld != b.sfld OR a.ord != b.ord"
+                          " ORDER BY a.pos"),
+            ], limit))
+
+            models_a, decks_a = _read_config(conn)
+            models_b, decks_b = _read_config(conn, 'b')
+        except sqlite3.DatabaseError as e:
+            raise ApkgError('%s, %s: %s' % (filename_a, filename_b, e))
+        finally:
+            conn.close()
+
+        media = _diff_keys(a.media_hashes(), b.media_hashes(), limit)
+
+    result = {
+        'notes': notes,
+        'cards': cards,
+        'media': media,
+        'models': normalize_models(models_a) == normalize_models(models_b),
+        'decks': normalize_decks(decks_a) == normalize_decks(decks_b),
+    }
+    result['equal'] = (
+        result['models'] and result['decks'] and
+        not any(notes[x] for x in ('only_a', 'only_b', 'changed')) and
+        not any(cards[x] for x in ('only_a', 'only_b', 'order')) and
+        not any(media[x] for x in ('only_a', 'only_b', 'changed')))
+    return result
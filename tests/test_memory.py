@@ -0,0 +1,84 @@
+"""
+Check that deck generation memory usage doesn't grow with input size
+when translation size is limited.
+"""
+import os.path as op
+import subprocess
+import sys
+import pytest
+
+resource = pytest.importorskip('resource')
+
+ROOT = op.dirname(op.dirname(op.abspath(__file__)))
+
+# Peak RSS budget for the deck build process, in MB.
+RSS_BUDGET = 150
+
+MAX_ARTICLE_SIZE = 10000
+
+# (number of words, size of one huge article in MB, article is one line)
+SIZES = [(1000, 1, False), (4000, 4, False), (16000, 16, False),
+         (1000, 1, True), (4000, 4, True), (16000, 16, True)]
+
+SCRIPT = """
+import sys
+import logging
+from anki_deck.apkg import Deck
+from anki_deck.parser import get_cards
+
+logging.disable(logging.WARNING)
+words, dict_file, out, max_size = sys.argv[1:]
+get_cards(words, dict_file, None, Deck(out, None, 'Test'), int(max_size))
+"""
+
+
+def make_input(path, count, article_mb, single_line):
+    """Create words and dict files with `count` words and a huge article.
+
+    The huge article is written in many short lines or, if `single_line`
+    is True, in one line right after the word.
+    """
+    words = op.join(str(path), 'words.txt')
+    dict_file = op.join(str(path), 'dict.xdxf')
+    line = '<blockquote>sense <ex>example</ex></blockquote>'
+    if not single_line:
+        line += '\n'
+
+    with open(words, 'w') as f:
+        f.write('huge\n')
+        for i in range(count):
+            f.write('word%d\n' % i)
+
+    with open(dict_file, 'w') as f:
+        f.write('<xdxf>\n<ar><k>huge</k>\n [hju:dZ] first')
+        if not single_line:
+            f.write('\n')
+        for _ in range(article_mb * 1024 * 1024 // len(line)):
+            f.write(line)
+        f.write('</ar>\n')
+        for i in range(count):
+            f.write('<ar><k>word%d</k>\n [w] <blockquote>meaning %d'
+                    '</blockquote></ar>\n' % (i, i))
+        f.write('</xdxf>\n')
+    return words, dict_file
+
+
+def peak_rss_mb():
+    """Return peak RSS of the finished child processes in MB."""
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux reports kilobytes, macOS - bytes.
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss // 1024
+
+
+@pytest.mark.parametrize('count,article_mb,single_line', SIZES)
+def test_peak_rss(tmpdir, count, article_mb, single_line):
+    words, dict_file = make_input(tmpdir, count, article_mb, single_line)
+    out = op.join(str(tmpdir), 'deck.apkg')
+
+    subprocess.check_call([sys.executable, '-c', SCRIPT, words, dict_file,
+                           out, str(MAX_ARTICLE_SIZE)], cwd=ROOT)
+
+    assert op.exists(out)
+    assert peak_rss_mb() < RSS_BUDGET